@@ -1,6 +1,7 @@
 import bpy
 import json
 import math
+import numpy as np
 
 # Class for creating a wall
 class Wall:
@@ -49,49 +50,98 @@ class Cutout:
         cutout.scale[2] = self.scale[2]
         return cutout
 
-# Class for creating a ceiling fan
-class CeilingFan:
-    def __init__(self, location, blade_count, blade_offset, blade_length, blade_width):
+# Base class for parametric fixtures built from NumPy vertex/face buffers
+# Subclasses (fans, lights, railings...) provide mesh_name() and build_buffers(); objects with the
+# same parameters share one mesh datablock, so a repeated fixture is an instance, not a rebuild
+class Fixture:
+    def __init__(self, name, location):
+        self.name = name
         self.location = location
+        self.object = self.create_object()
+
+    def mesh_name(self):
+        raise NotImplementedError
+
+    def build_buffers(self):
+        # Returns vertex coordinates (N, 3), flat face vertex indices and the vertex count of each face
+        raise NotImplementedError
+
+    def get_mesh(self):
+        mesh = bpy.data.meshes.get(self.mesh_name())
+        if mesh is None:
+            mesh = self.create_mesh()
+        return mesh
+
+    def create_mesh(self):
+        vertices, loops, loop_totals = self.build_buffers()
+        loop_starts = np.zeros(len(loop_totals), dtype=np.int32)
+        np.cumsum(loop_totals[:-1], out=loop_starts[1:])
+
+        mesh = bpy.data.meshes.new(self.mesh_name())
+        mesh.vertices.add(len(vertices))
+        mesh.vertices.foreach_set("co", vertices.astype(np.float32).ravel())
+        mesh.loops.add(len(loops))
+        mesh.loops.foreach_set("vertex_index", loops.astype(np.int32))
+        mesh.polygons.add(len(loop_totals))
+        mesh.polygons.foreach_set("loop_start", loop_starts)
+        # Face sizes are derived from loop_start in newer Blender versions
+        if not bpy.types.MeshPolygon.bl_rna.properties['loop_total'].is_readonly:
+            mesh.polygons.foreach_set("loop_total", loop_totals.astype(np.int32))
+        mesh.update()
+        mesh.validate()
+        return mesh
+
+    def create_object(self):
+        fixture = bpy.data.objects.new(self.name, self.get_mesh())
+        fixture.location = self.location
+        bpy.context.collection.objects.link(fixture)
+        return fixture
+
+# Class for creating a ceiling fan
+class CeilingFan(Fixture):
+    def __init__(self, location, blade_count, blade_offset, blade_length, blade_width,
+                 housing_radius=0.2, housing_depth=0.5, housing_segments=32):
         self.blade_count = blade_count
         self.blade_offset = blade_offset
         self.blade_length = blade_length
         self.blade_width = blade_width
-        self.motor_housing = self.create_motor_housing()
-        self.blades = self.create_blades()
-        self.join_parts()
-
-    def create_motor_housing(self):
-        bpy.ops.mesh.primitive_cylinder_add(radius=0.2, depth=0.5, location=self.location)
-        motor_housing = bpy.context.object
-        motor_housing.name = "MotorHousing"
-        return motor_housing
-
-    def create_blade(self, location, rotation):
-        bpy.ops.mesh.primitive_plane_add(size=1, location=location)
-        blade = bpy.context.object
-        blade.name = "FanBlade"
-        blade.scale[0] = self.blade_length  # Length of the blade
-        blade.scale[1] = self.blade_width  # Width of the blade
-        blade.rotation_euler = rotation
-        return blade
-
-    def create_blades(self):
-        blades = []
-        blade_rotations = [(0, 0, math.radians(i * (360 / self.blade_count))) for i in range(self.blade_count)]
-        for rotation in blade_rotations:
-            location = (self.blade_offset * math.cos(rotation[2]), self.blade_offset * math.sin(rotation[2]), self.location[2])
-            blade = self.create_blade(location, rotation)
-            blades.append(blade)
-        return blades
-
-    def join_parts(self):
-        bpy.ops.object.select_all(action='DESELECT')
-        self.motor_housing.select_set(True)
-        for blade in self.blades:
-            blade.select_set(True)
-        bpy.context.view_layer.objects.active = self.motor_housing
-        bpy.ops.object.join()
+        self.housing_radius = housing_radius
+        self.housing_depth = housing_depth
+        self.housing_segments = housing_segments
+        super().__init__("CeilingFan", location)
+
+    def mesh_name(self):
+        return (f"CeilingFan_{self.blade_count}_{self.blade_offset:g}_{self.blade_length:g}_{self.blade_width:g}"
+                f"_{self.housing_radius:g}_{self.housing_depth:g}_{self.housing_segments}")
+
+    def build_buffers(self):
+        segments = self.housing_segments
+        blade_count = self.blade_count
+
+        # Motor housing: two rings of the cylinder, quad sides and an n-gon cap at each end
+        angles = np.linspace(0, 2 * math.pi, segments, endpoint=False)
+        ring = self.housing_radius * np.column_stack((np.cos(angles), np.sin(angles)))
+        half_depth = self.housing_depth / 2
+        housing = np.concatenate((np.column_stack((ring, np.full(segments, -half_depth))),
+                                  np.column_stack((ring, np.full(segments, half_depth)))))
+        index = np.arange(segments)
+        sides = np.column_stack((index, (index + 1) % segments, (index + 1) % segments + segments, index + segments))
+        bottom = index[::-1]
+        top = index + segments
+
+        # Blades: one unit quad scaled, rotated and offset for every blade at once
+        corners = np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]]) * (self.blade_length, self.blade_width)
+        blade_angles = 2 * math.pi * np.arange(blade_count) / blade_count
+        cos, sin = np.cos(blade_angles), np.sin(blade_angles)
+        rotations = np.stack((np.column_stack((cos, -sin)), np.column_stack((sin, cos))), axis=1)
+        blades = np.einsum('nij,kj->nki', rotations, corners) + self.blade_offset * np.column_stack((cos, sin))[:, None, :]
+        blades = np.concatenate((blades.reshape(-1, 2), np.zeros((blade_count * 4, 1))), axis=1)
+        blade_faces = 2 * segments + np.arange(blade_count * 4).reshape(blade_count, 4)
+
+        vertices = np.concatenate((housing, blades))
+        loops = np.concatenate((sides.ravel(), bottom, top, blade_faces.ravel()))
+        loop_totals = np.concatenate((np.full(segments, 4), [segments, segments], np.full(blade_count, 4)))
+        return vertices, loops, loop_totals
 
 # Class for creating a door or window
 class DoorWindow:
@@ -1,6 +1,34 @@
+import argparse
 import bpy
+import hashlib
 import json
 import math
+import os
+import subprocess
+import sys
+from bisect import bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from mathutils import Euler, Vector
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from plan_io import PlanReader, iter_json_rooms, padded
+from plan_validation import PlanValidator
+
+# Separating axis test between two oriented boxes given as (center, axes, half extents)
+def boxes_intersect(box_a, box_b, tolerance=1e-3):
+    center_a, axes_a, extents_a = box_a
+    center_b, axes_b, extents_b = box_b
+    offset = center_b - center_a
+    for axis in [*axes_a, *axes_b, *(a.cross(b) for a in axes_a for b in axes_b)]:
+        if axis.length < tolerance:
+            continue  # Parallel edges, already covered by the face axes
+        axis = axis.normalized()
+        radius_a = sum(extent * abs(a.dot(axis)) for a, extent in zip(axes_a, extents_a))
+        radius_b = sum(extent * abs(b.dot(axis)) for b, extent in zip(axes_b, extents_b))
+        # Boxes only touching each other do not count as intersecting
+        if abs(offset.dot(axis)) >= radius_a + radius_b - tolerance:
+            return False
+    return True
 
 # Class for creating a wall
 class Wall:
@@ -32,6 +60,336 @@ class Wall:
         self.object.select_set(True)
         bpy.ops.object.shade_smooth()
 
+# Class for indexing walls across rooms so coincident walls are only built once
+class WallIndex:
+    def __init__(self, tolerance=1e-3, cell_size=2.0, assign_openings=False):
+        self.tolerance = tolerance
+        self.cell_size = cell_size
+        self.assign_openings = assign_openings  # Cut doors/windows into the walls they intersect, not the named wall
+        self.entries = []
+        self.keys = {}  # (room key, wall name) -> entry id, the last wall of that name like Room.walls
+        self.room_walls = {}  # room key -> [entry id] in the order of the room's walls
+        self.planes = {}  # (normal key, offset bin) -> [span bucket], one bucket per offset and height range
+        self.grid = {}  # (cell x, cell y) -> [entry id] of walls whose footprint touches the cell
+        self.pending = []
+        self.cuts = {}  # Built wall -> [(center, half extents)] of the openings cut into it
+
+    def geometry(self, wall_config):
+        location = Vector(padded(wall_config['location'], 0))
+        scale = padded(wall_config['scale'], 1)
+        matrix = Euler(padded(wall_config['rotation'], 0)).to_matrix()
+        axes = [matrix @ Vector(axis) for axis in ((1, 0, 0), (0, 1, 0), (0, 0, 1))]
+
+        # Canonical plane normal so walls facing opposite ways share a key
+        normal = axes[2]
+        for component in normal:
+            if abs(component) > self.tolerance:
+                if component < 0:
+                    normal = -normal
+                break
+
+        # In-plane axes derived from the normal, not from the wall's own rotation
+        if abs(normal.z) > 1 - self.tolerance:
+            u_axis = Vector((1, 0, 0))
+        else:
+            u_axis = Vector((0, 0, 1)).cross(normal).normalized()
+        v_axis = normal.cross(u_axis)
+
+        # Local axis running along u, the one a wall gets shortened along when part of it is shared
+        trim_axis = None
+        for index in (0, 1):
+            if abs(axes[index].dot(u_axis)) > 1 - self.tolerance:
+                trim_axis = index
+
+        corners = [location + matrix @ Vector((x * scale[0], y * scale[1], 0)) for x in (-1, 1) for y in (-1, 1)]
+        us = [corner.dot(u_axis) for corner in corners]
+        vs = [corner.dot(v_axis) for corner in corners]
+        return {
+            'normal': tuple(round(value / self.tolerance) for value in normal),
+            'offset': normal.dot(location),
+            'u_axis': u_axis,
+            'trim_axis': trim_axis,
+            'rect': (min(us), max(us), min(vs), max(vs)),
+            'axes': axes,
+            'cells': self.cells([corner.x for corner in corners], [corner.y for corner in corners]),
+        }
+
+    def cells(self, xs, ys):
+        x_range = range(math.floor(min(xs) / self.cell_size), math.floor(max(xs) / self.cell_size) + 1)
+        y_range = range(math.floor(min(ys) / self.cell_size), math.floor(max(ys) / self.cell_size) + 1)
+        return [(x, y) for x in x_range for y in y_range]
+
+    def index(self, room_key, walls_config):
+        for wall_config in walls_config:
+            entry = self.geometry(wall_config)
+            rect = entry['rect']
+            # Only the transform is kept, not the config, and it is dropped once the wall is built
+            entry.update({
+                'room': room_key,
+                'name': wall_config['name'],
+                'location': padded(wall_config['location'], 0),
+                'scale': padded(wall_config['scale'], 1),
+                'rotation': padded(wall_config['rotation'], 0),
+                'area': (rect[1] - rect[0]) * (rect[3] - rect[2]),
+                'pieces': [],  # (location, scale) of every part of the wall that gets built
+                'boxes': [],  # Box of every piece, kept for cutting openings
+                'covers': [],  # Entry ids of earlier walls that already build part of this one
+                'walls': None,
+            })
+            entry_id = len(self.entries)
+            self.entries.append(entry)
+            if (room_key, wall_config['name']) in self.keys:
+                print(f"Room {room_key} has more than one wall named {wall_config['name']}, "
+                      f"openings on it use the last one")
+            self.keys[(room_key, wall_config['name'])] = entry_id
+            self.room_walls.setdefault(room_key, []).append(entry_id)
+            self.pending.append(entry_id)
+            for cell in entry.pop('cells'):
+                self.grid.setdefault(cell, []).append(entry_id)
+
+    def plane_buckets(self, entry):
+        # Neighbouring offset bins too, so walls within tolerance never miss each other at a bin edge
+        offset_bin = round(entry['offset'] / self.tolerance)
+        for key in ((entry['normal'], offset_bin + step) for step in (-1, 0, 1)):
+            for bucket in self.planes.get(key, []):
+                if abs(bucket['offset'] - entry['offset']) <= self.tolerance:
+                    yield bucket
+
+    def overlapping_spans(self, spans, u_min, u_max):
+        # Spans of a bucket never overlap, so sorted by start they are sorted by end too
+        index = max(bisect_right(spans, (u_min, math.inf, math.inf)) - 1, 0)
+        while index < len(spans) and spans[index][0] < u_max - self.tolerance:
+            if spans[index][1] > u_min + self.tolerance:
+                yield spans[index]
+            index += 1
+
+    def subtract(self, remaining, start, end):
+        result = []
+        for u_min, u_max in remaining:
+            if end <= u_min or start >= u_max:
+                result.append((u_min, u_max))
+                continue
+            if start - u_min > self.tolerance:
+                result.append((u_min, start))
+            if u_max - end > self.tolerance:
+                result.append((end, u_max))
+        return result
+
+    def resolve(self):
+        # Largest walls first, so smaller walls are the ones that get shortened or dropped
+        self.pending.sort(key=lambda entry_id: -self.entries[entry_id]['area'])
+        for entry_id in self.pending:
+            self.place(entry_id)
+        self.pending = []
+
+    def place(self, entry_id):
+        entry = self.entries[entry_id]
+        u_min, u_max, v_min, v_max = entry['rect']
+        tol = self.tolerance
+
+        # Remove every span already built by walls on the same plane covering this wall's height
+        remaining = [(u_min, u_max)]
+        own_bucket = None
+        for bucket in list(self.plane_buckets(entry)):
+            b_v_min, b_v_max = bucket['v']
+            covering = b_v_min <= v_min + tol and b_v_max >= v_max - tol
+            for start, end, other_id in self.overlapping_spans(bucket['spans'], u_min, u_max):
+                if covering:
+                    remaining = self.subtract(remaining, start, end)
+                    if other_id not in entry['covers']:
+                        entry['covers'].append(other_id)
+                elif b_v_min < v_max - tol and b_v_max > v_min + tol:
+                    other = self.entries[other_id]
+                    print(f"Wall {entry['name']} of {entry['room']} overlaps the lower wall "
+                          f"{other['name']} of {other['room']}, keeping both")
+            if abs(b_v_min - v_min) <= tol and abs(b_v_max - v_max) <= tol:
+                own_bucket = bucket
+
+        if remaining != [(u_min, u_max)] and remaining and entry['trim_axis'] is None:
+            print(f"Wall {entry['name']} of {entry['room']} is partly shared but not aligned "
+                  f"with the shared wall, keeping it whole")
+            # Not added to the spans, they have to stay disjoint
+            entry['covers'] = []
+            self.add_piece(entry, u_min, u_max)
+            return entry
+
+        if own_bucket is None:
+            own_bucket = {'offset': entry['offset'], 'v': (v_min, v_max), 'spans': []}
+            self.planes.setdefault((entry['normal'], round(entry['offset'] / tol)), []).append(own_bucket)
+        for start, end in remaining:
+            insort(own_bucket['spans'], (start, end, entry_id))
+            self.add_piece(entry, start, end)
+        return entry
+
+    def add_piece(self, entry, start, end):
+        location = Vector(entry['location'])
+        scale = list(entry['scale'])
+        if (start, end) != entry['rect'][:2]:
+            u_min, u_max = entry['rect'][:2]
+            location += entry['u_axis'] * ((start + end) / 2 - (u_min + u_max) / 2)
+            scale[entry['trim_axis']] = (end - start) / 2
+        entry['pieces'].append((list(location), scale))
+        entry['boxes'].append((location, entry['axes'], (scale[0], scale[1], 0)))
+
+    def built(self, entry_id):
+        entry = self.entries[entry_id]
+        if entry['walls'] is None:
+            entry['walls'] = [Wall(entry['name'], location, scale, entry['rotation'])
+                              for location, scale in entry['pieces']]
+            for key in ('location', 'scale', 'rotation', 'pieces'):
+                del entry[key]
+        return entry['walls']
+
+    # Wall at position in the room's wall list, walls are matched by position since names may repeat
+    def wall(self, room_key, wall_config, position):
+        if position >= len(self.room_walls.get(room_key, [])):
+            self.index(room_key, [wall_config])
+        if self.pending:
+            self.resolve()
+        return self.representative(self.room_walls[room_key][position])
+
+    def representative(self, entry_id):
+        # A wall fully shared with earlier walls is represented by the first of them
+        for candidate in [entry_id] + self.entries[entry_id]['covers']:
+            if self.built(candidate):
+                return self.built(candidate)[0]
+
+    def opening_box(self, location, scale):
+        return (Vector(padded(location, 0)), [Vector((1, 0, 0)), Vector((0, 1, 0)), Vector((0, 0, 1))], scale)
+
+    def cut_walls(self, entry_ids, box):
+        walls = []
+        for entry_id in entry_ids:
+            for piece_box, wall in zip(self.entries[entry_id]['boxes'], self.built(entry_id)):
+                if boxes_intersect(piece_box, box, self.tolerance):
+                    walls.append(wall)
+        return walls
+
+    def walls_for_named_opening(self, room_key, opening_config):
+        if self.pending:
+            self.resolve()
+
+        # The named wall and the walls sharing its span, so openings in a shared part cut the shared wall
+        entry_id = self.keys[(room_key, opening_config['wall'])]
+        box = self.opening_box(opening_config['location'], opening_config['scale'])
+        walls = self.cut_walls([entry_id] + self.entries[entry_id]['covers'], box)
+        return walls or [self.representative(entry_id)]
+
+    def uncut_walls(self, walls, location, scale):
+        # A door between two rooms is listed by both, it is only cut once into the shared wall
+        center, extents = padded(location, 0), padded(scale, 1)
+        result = []
+        for wall in walls:
+            cuts = self.cuts.setdefault(wall, [])
+            if any(all(abs(a - b) <= self.tolerance for a, b in zip(center + extents, cut_center + cut_extents))
+                   for cut_center, cut_extents in cuts):
+                continue
+            cuts.append((center, extents))
+            result.append(wall)
+        return result
+
+    def walls_for_opening(self, location, scale):
+        if self.pending:
+            self.resolve()
+
+        box = self.opening_box(location, scale)
+        xs = (box[0].x - scale[0], box[0].x + scale[0])
+        ys = (box[0].y - scale[1], box[0].y + scale[1])
+
+        # Walls of other rooms are built on demand, so an opening can cut through every wall it crosses
+        candidates = []
+        for cell in self.cells(xs, ys):
+            for entry_id in self.grid.get(cell, []):
+                if entry_id not in candidates:
+                    candidates.append(entry_id)
+        return self.cut_walls(candidates, box)
+
+# Class for preprocessing floor textures once into downscaled tiers keyed by content hash
+class TextureCache:
+    tiers = (512, 1024, 2048, 4096)
+
+    def __init__(self, cache_dir, preview_tier=None):
+        self.cache_dir = cache_dir
+        self.preview_tier = preview_tier  # Force a tier for previews instead of following the render size
+        self.hashes = {}  # (path, size, mtime) -> content hash
+        self.images = {}  # (content hash, tier) -> image datablock shared by every floor
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if key not in self.hashes:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            self.hashes[key] = digest.hexdigest()
+        return self.hashes[key]
+
+    # Storey workers share the cache, so files are written under a name of this process and then
+    # moved into place; a file another worker already put there (and may have open) is kept
+    def publish(self, temp_path, final_path):
+        try:
+            os.replace(temp_path, final_path)
+        except OSError:
+            if not os.path.exists(final_path):
+                raise
+            os.remove(temp_path)
+
+    def manifest(self, path, content_hash):
+        manifest_path = os.path.join(self.cache_dir, content_hash + ".json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+
+        # Load the full resolution image once and write every smaller tier as uncompressed TGA
+        source = bpy.data.images.load(path)
+        width, height = source.size
+        tiers = {}
+        for tier in self.tiers:
+            if tier >= max(width, height):
+                break
+            factor = tier / max(width, height)
+            tier_image = source.copy()
+            tier_image.scale(max(1, round(width * factor)), max(1, round(height * factor)))
+            tier_path = os.path.join(self.cache_dir, f"{content_hash}_{tier}.tga")
+            tier_image.filepath_raw = os.path.join(self.cache_dir, f"{content_hash}_{tier}.{os.getpid()}.tga")
+            tier_image.file_format = 'TARGA_RAW'
+            tier_image.save()
+            self.publish(tier_image.filepath_raw, tier_path)
+            tiers[str(tier)] = tier_path
+            bpy.data.images.remove(tier_image)
+        bpy.data.images.remove(source)
+
+        # The manifest goes last, once it exists every tier it lists is complete
+        manifest = {'source': os.path.abspath(path), 'size': [width, height], 'tiers': tiers}
+        temp_path = f"{manifest_path}.{os.getpid()}"
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        self.publish(temp_path, manifest_path)
+        return manifest
+
+    def target_size(self):
+        if self.preview_tier is not None:
+            return self.preview_tier
+        render = bpy.context.scene.render
+        return max(render.resolution_x, render.resolution_y) * render.resolution_percentage / 100
+
+    def load(self, path):
+        content_hash = self.content_hash(path)
+        manifest = self.manifest(path, content_hash)
+
+        # Smallest tier covering the output size, the source itself when no tier is big enough
+        tier, tier_path = 'source', path
+        for size in sorted(manifest['tiers'], key=int):
+            if int(size) >= self.target_size():
+                tier, tier_path = size, manifest['tiers'][size]
+                break
+
+        if (content_hash, tier) not in self.images:
+            self.images[(content_hash, tier)] = bpy.data.images.load(tier_path, check_existing=True)
+        return self.images[(content_hash, tier)]
+
 # Class for creating a door or window cutout
 class Cutout:
     def __init__(self, name, location, scale):
@@ -52,14 +410,17 @@ class Cutout:
 # Class for creating a door or window
 class DoorWindow:
     def __init__(self, wall, name, location, scale, material):
-        self.wall = wall
+        self.walls = wall if isinstance(wall, list) else [wall]
+        self.wall = self.walls[0]
         self.cutout = Cutout(name, location, scale)
         self.add_door_window(material)
 
     def add_door_window(self, material):
-        self.wall.add_cutout(self.cutout.object)
+        for wall in self.walls:
+            wall.add_cutout(self.cutout.object)
         self.cutout.object.data.materials.append(material)
-        self.wall.shade_smooth()
+        for wall in self.walls:
+            wall.shade_smooth()
 
 # Class for creating a door/window material
 class DoorMaterial:
@@ -77,7 +438,10 @@ class DoorMaterial:
 
 # Class for creating a room
 class Room:
-    def __init__(self, config, floor_location):
+    def __init__(self, config, floor_location, key=None, wall_index=None, texture_cache=None):
+        self.key = key
+        self.wall_index = wall_index
+        self.texture_cache = texture_cache
         self.length = config['dimensions']['length']
         self.width = config['dimensions']['width']
         self.height = config['dimensions']['height']
@@ -109,7 +473,11 @@ class Room:
 
             # Create a new image texture node and load the texture file
             tex_image = mat.node_tree.nodes.new("ShaderNodeTexImage")
-            tex_type = bpy.data.images.load(self.floor_type_file)
+            if self.texture_cache is not None:
+                # Downscaled tier matching the render size, shared with the other floors
+                tex_type = self.texture_cache.load(self.floor_type_file)
+            else:
+                tex_type = bpy.data.images.load(self.floor_type_file)
             tex_image.image = tex_type
 
             # Link the image texture to the base color input of the Principled BSDF node
@@ -127,8 +495,12 @@ class Room:
 
     def create_walls(self, walls_config):
         self.walls = {}
-        for wall in walls_config:
-            new_wall = Wall(wall['name'], wall['location'], wall['scale'], wall['rotation'])
+        for position, wall in enumerate(walls_config):
+            if self.wall_index is not None:
+                # Walls shared with an already built room are reused, openings get cut into both
+                new_wall = self.wall_index.wall(self.key, wall, position)
+            else:
+                new_wall = Wall(wall['name'], wall['location'], wall['scale'], wall['rotation'])
             self.walls[wall['name']] = new_wall
 
     def add_doors_and_windows(self, doors_config, windows_config):
@@ -139,13 +511,34 @@ class Room:
             self.create_window(window)
 
     def create_door(self, door_config):
-        door = DoorWindow(self.walls[door_config['wall']], door_config['name'], door_config['location'], door_config['scale'], self.door_material)
+        walls = self.opening_walls(door_config)
+        if not walls:
+            return  # Already cut from the other room of a shared wall
+        door = DoorWindow(walls, door_config['name'], door_config['location'], door_config['scale'], self.door_material)
 
     def create_window(self, window_config):
-        window = DoorWindow(self.walls[window_config['wall']], window_config['name'], window_config['location'], window_config['scale'], self.door_material)
+        walls = self.opening_walls(window_config)
+        if not walls:
+            return  # Already cut from the other room of a shared wall
+        window = DoorWindow(walls, window_config['name'], window_config['location'], window_config['scale'], self.door_material)
+
+    def opening_walls(self, opening_config):
+        if self.wall_index is None:
+            return [self.walls[opening_config['wall']]]
+        walls = []
+        if self.wall_index.assign_openings:
+            walls = self.wall_index.walls_for_opening(opening_config['location'], opening_config['scale'])
+            if not walls:
+                print(f"Opening {opening_config['name']} does not intersect any wall, using wall {opening_config.get('wall')}")
+        if not walls:
+            walls = self.wall_index.walls_for_named_opening(self.key, opening_config)
+        return self.wall_index.uncut_walls(walls, opening_config['location'], opening_config['scale'])
 
 class Toilet:
-    def __init__(self, config, location):
+    def __init__(self, config, location, key=None, wall_index=None, texture_cache=None):
+        self.key = key
+        self.wall_index = wall_index
+        self.texture_cache = texture_cache
         self.length = config['dimensions']['length']
         self.width = config['dimensions']['width']
         self.height = config['dimensions']['height']
@@ -177,7 +570,11 @@ class Toilet:
 
             # Create a new image texture node and load the texture file
             tex_image = mat.node_tree.nodes.new("ShaderNodeTexImage")
-            tex_type = bpy.data.images.load(self.floor_type_file)
+            if self.texture_cache is not None:
+                # Downscaled tier matching the render size, shared with the other floors
+                tex_type = self.texture_cache.load(self.floor_type_file)
+            else:
+                tex_type = bpy.data.images.load(self.floor_type_file)
             tex_image.image = tex_type
 
             # Link the image texture to the base color input of the Principled BSDF node
@@ -195,8 +592,12 @@ class Toilet:
 
     def create_walls(self, walls_config):
         self.walls = {}
-        for wall in walls_config:
-            new_wall = Wall(wall['name'], wall['location'], wall['scale'], wall['rotation'])
+        for position, wall in enumerate(walls_config):
+            if self.wall_index is not None:
+                # Walls shared with an already built room are reused, openings get cut into both
+                new_wall = self.wall_index.wall(self.key, wall, position)
+            else:
+                new_wall = Wall(wall['name'], wall['location'], wall['scale'], wall['rotation'])
             self.walls[wall['name']] = new_wall
 
     def add_doors_and_windows(self, doors_config, windows_config):
@@ -207,27 +608,231 @@ class Toilet:
             self.create_window(window)
 
     def create_door(self, door_config):
-        door = DoorWindow(self.walls[door_config['wall']], door_config['name'], door_config['location'], door_config['scale'], self.door_material)
+        walls = self.opening_walls(door_config)
+        if not walls:
+            return  # Already cut from the other room of a shared wall
+        door = DoorWindow(walls, door_config['name'], door_config['location'], door_config['scale'], self.door_material)
 
     def create_window(self, window_config):
-        window = DoorWindow(self.walls[window_config['wall']], window_config['name'], window_config['location'], window_config['scale'], self.door_material)
-
-# Load the configuration file
-with open("D:\Ced_data\data-prefinal.json", 'r') as f:
-    config = json.load(f)
-
-# Create rooms based on the configuration
-room1 = Room(config['room1'], (0, 0, 0))
-room2 = Room(config['room2'], (20,-4, 0))  
-room3 = Room(config['room3'], (20,4,0))
-room4 = Room(config['studyroom'],(-8,12,0))
-room5 = Room(config['bigroom'],(1,0,0))
-# Create a toilet based on the configuration
-toilet = Toilet(config['toilet1'], (27,-6, 0))  
-toilet = Toilet(config['toilet2'], (27,5,0))
+        walls = self.opening_walls(window_config)
+        if not walls:
+            return  # Already cut from the other room of a shared wall
+        window = DoorWindow(walls, window_config['name'], window_config['location'], window_config['scale'], self.door_material)
+
+    def opening_walls(self, opening_config):
+        if self.wall_index is None:
+            return [self.walls[opening_config['wall']]]
+        walls = []
+        if self.wall_index.assign_openings:
+            walls = self.wall_index.walls_for_opening(opening_config['location'], opening_config['scale'])
+            if not walls:
+                print(f"Opening {opening_config['name']} does not intersect any wall, using wall {opening_config.get('wall')}")
+        if not walls:
+            walls = self.wall_index.walls_for_named_opening(self.key, opening_config)
+        return self.wall_index.uncut_walls(walls, opening_config['location'], opening_config['scale'])
+
+# Class for building every storey in its own background Blender and linking them into one scene
+class StoreyAssembly:
+    def __init__(self, plan_path, parts_dir, storey_height=3.0, workers=None):
+        self.plan_path = plan_path
+        self.parts_dir = parts_dir
+        self.storey_height = storey_height
+        self.workers = workers or os.cpu_count()
+        self.signatures = {}  # storey -> hash of its rooms and of the scripts
+        os.makedirs(parts_dir, exist_ok=True)
+
+        # Workers also run the plan reading and validation modules, a change there rebuilds every storey
+        digest = hashlib.sha1()
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        for script in (os.path.abspath(__file__), os.path.join(script_dir, 'plan_io.py'),
+                       os.path.join(script_dir, 'plan_validation.py')):
+            with open(script, 'rb') as f:
+                digest.update(f.read())
+        self.script_hash = digest.hexdigest()
+
+    def scan(self, plan_rooms, layout):
+        # Rooms are hashed as they are read, nothing but one digest per storey is kept
+        for key, room_config in plan_rooms:
+            if key not in layout:
+                continue
+            storey = room_config.get('storey', 0)
+            if storey not in self.signatures:
+                self.signatures[storey] = hashlib.sha1(self.script_hash.encode('utf-8'))
+            self.signatures[storey].update(json.dumps([key, layout[key][1], room_config], sort_keys=True).encode('utf-8'))
+        self.signatures = {storey: digest.hexdigest()[:16] for storey, digest in self.signatures.items()}
+
+    def part_path(self, storey):
+        return os.path.join(self.parts_dir, f"storey_{storey}_{self.signatures[storey]}.blend")
+
+    def build_part(self, storey):
+        subprocess.run([
+            bpy.app.binary_path, '--background', '--factory-startup', '--python', os.path.abspath(__file__),
+            '--', '--plan', self.plan_path, '--storey', str(storey), '--output', self.part_path(storey),
+        ], check=True)
+
+    def build(self):
+        # Storeys whose rooms did not change since the last build reuse their saved file
+        changed = [storey for storey in self.signatures if not os.path.exists(self.part_path(storey))]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.build_part, changed))
+
+    def link(self):
+        instances = {}
+        for storey in sorted(self.signatures):
+            name = f"Storey_{storey}"
+            with bpy.data.libraries.load(self.part_path(storey), link=True) as (data_from, data_to):
+                data_to.collections = [name]
+            instance = bpy.data.objects.new(name, None)
+            instance.instance_type = 'COLLECTION'
+            instance.instance_collection = data_to.collections[0]
+            instance.location = (0, 0, storey * self.storey_height)
+            bpy.context.scene.collection.objects.link(instance)
+            instances[storey] = instance
+        return instances
+
+# Arguments after '--' are only given to storey workers started by StoreyAssembly
+parser = argparse.ArgumentParser()
+parser.add_argument('--plan', default="D:\Ced_data\data-prefinal.json")
+parser.add_argument('--storey', type=int)
+parser.add_argument('--output')
+args = parser.parse_args(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+
+# Load the configuration file, plans converted with plan_io.py (.bfp) are memory-mapped
+# and each room is only decoded when it gets built
+plan_path = args.plan
+# Build every room as soon as it has been read from the JSON, for plans too big to load at once
+stream_plan = False
+# Build each storey (the optional 'storey' of a room, 0 by default) in a parallel background
+# Blender and link the saved storeys into this scene
+assemble_storeys = False
+# Room coordinates are relative to their storey, rooms of storey n are raised by n * storey_height
+storey_height = 3.0
+# Reject plans with misplaced openings or overlapping furniture before anything gets built,
+# storey workers skip it since the master validated the whole plan before starting them
+validate_plan_first = args.storey is None
+if plan_path.endswith('.bfp'):
+    config = PlanReader(plan_path)
+elif stream_plan:
+    config = None
+else:
+    with open(plan_path, 'r') as f:
+        config = json.load(f)
+
+# Rooms and toilets of the plan with their floor location
+plan_layout = [
+    ('room1', Room, (0, 0, 0)),
+    ('room2', Room, (20, -4, 0)),
+    ('room3', Room, (20, 4, 0)),
+    ('studyroom', Room, (-8, 12, 0)),
+    ('bigroom', Room, (1, 0, 0)),
+    ('toilet1', Toilet, (27, -6, 0)),
+    ('toilet2', Toilet, (27, 5, 0)),
+]
+layout = {key: (room_class, location) for key, room_class, location in plan_layout}
+
+# Set assign_openings to cut doors and windows by geometry instead of their 'wall' name
+wall_index = WallIndex(assign_openings=False)
+
+# Floor textures are preprocessed once into resolution tiers, pass preview_tier=512 for quick previews
+texture_cache = TextureCache("D:/Ced_data/texture_cache")
+
+# A storey worker builds only its own rooms, into a collection the master scene links
+if args.storey is not None:
+    storey_collection = bpy.data.collections.new(f"Storey_{args.storey}")
+    bpy.context.scene.collection.children.link(storey_collection)
+    view_layer = bpy.context.view_layer
+    view_layer.active_layer_collection = view_layer.layer_collection.children[storey_collection.name]
+
+def in_build(room_config):
+    return args.storey is None or room_config.get('storey', 0) == args.storey
+
+# Room config and floor location raised to the room's storey; a storey worker builds its storey
+# at z=0 and the master scene places it with the storey instance instead
+def placed(room_config, location):
+    offset = 0 if args.storey is not None else room_config.get('storey', 0) * storey_height
+    if not offset:
+        return room_config, location
+    room_config = dict(room_config)
+    for kind in ('walls', 'doors', 'windows'):
+        elements = []
+        for element in room_config.get(kind, []):
+            element_location = padded(element['location'], 0)
+            element_location[2] += offset
+            elements.append({**element, 'location': element_location})
+        room_config[kind] = elements
+    return room_config, (location[0], location[1], location[2] + offset)
+
+# Room coordinates are relative to their storey, so every storey is validated on its own
+validators = {}  # storey -> PlanValidator
+
+# Passes rooms through while adding the ones that get built to the validator of their storey
+def validated(plan_rooms):
+    for key, room_config in plan_rooms:
+        if validate_plan_first and key in layout and in_build(room_config):
+            storey = room_config.get('storey', 0)
+            if storey not in validators:
+                validators[storey] = PlanValidator(check_named_walls=not wall_index.assign_openings)
+            validators[storey].add(key, room_config)
+        yield key, room_config
+
+def check_plan():
+    if not validate_plan_first:
+        return
+    issues = []
+    for storey in sorted(validators):
+        report = validators[storey].validate()
+        issues += [f"storey {storey}: {issue['message']}" for issue in report['issues']]
+    if issues:
+        raise ValueError(f"Plan {plan_path} failed validation: " + "; ".join(issues[:10]))
+
+# Create rooms and toilets based on the configuration
+rooms = {}
+if assemble_storeys and args.storey is None:
+    assembly = StoreyAssembly(plan_path, "D:/Ced_data/storeys", storey_height=storey_height)
+    if config is not None:
+        assembly.scan(validated((key, config[key]) for key, _, _ in plan_layout), layout)
+    else:
+        assembly.scan(validated(iter_json_rooms(plan_path)), layout)
+    check_plan()
+    assembly.build()
+    storeys = assembly.link()
+elif config is not None:
+    # Rooms of a binary plan are decoded on access, so each is decoded once for validating
+    # and indexing and once more for building, without holding every decoded room
+    build_keys = []
+    for key, room_config in validated((key, config[key]) for key, _, _ in plan_layout):
+        if in_build(room_config):
+            build_keys.append(key)
+            # Index every wall of the plan first so walls shared between rooms are only built once
+            wall_index.index(key, placed(room_config, layout[key][1])[0]['walls'])
+        del room_config
+    check_plan()
+    for key in build_keys:
+        room_class, location = layout[key]
+        room_config, location = placed(config[key], location)
+        rooms[key] = room_class(room_config, location, key=key, wall_index=wall_index, texture_cache=texture_cache)
+else:
+    # A first pass over the file only keeps the boxes the validator needs
+    if validate_plan_first:
+        for key, room_config in validated(iter_json_rooms(plan_path)):
+            del room_config
+        check_plan()
+    # Rooms are built in file order and their walls indexed as they come, so a shared wall
+    # is only reused when it is contained in a wall of a room read earlier
+    for key, room_config in iter_json_rooms(plan_path):
+        if key in layout and in_build(room_config):
+            room_class, location = layout[key]
+            room_config, location = placed(room_config, location)
+            rooms[key] = room_class(room_config, location, key=key, wall_index=wall_index, texture_cache=texture_cache)
+        del room_config
+
+if args.storey is not None:
+    bpy.ops.wm.save_as_mainfile(filepath=args.output)
+
 # Switch to Material Preview mode
-for area in bpy.context.screen.areas:
-    if area.type == 'VIEW_3D':
-        for space in area.spaces:
-            if space.type == 'VIEW_3D':
-                space.shading.type = 'MATERIAL'
\ No newline at end of file
+if not bpy.app.background:
+    for area in bpy.context.screen.areas:
+        if area.type == 'VIEW_3D':
+            for space in area.spaces:
+                if space.type == 'VIEW_3D':
+                    space.shading.type = 'MATERIAL'
\ No newline at end of file
@@ -2,6 +2,11 @@ import bpy
 import json
 import math
 import os
+import sys
+from mathutils import Vector
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from plan_validation import validate_plan
 
 # Class for creating a wall
 class Wall:
@@ -98,6 +103,7 @@ class Furniture:
         self.rotation = rotation
         self.object = self.import_furniture()
         self.apply_material()
+        self.lod_meshes = FurnitureLOD.meshes_for(self)
 
     def import_furniture(self):
         if self.model_path.lower().endswith('.blend'):
@@ -140,20 +146,80 @@ class Furniture:
                 self.object.data.materials[0] = mat
             else:
                 self.object.data.materials.append(mat)
+            self.material = mat
+
+# Class for creating decimated level-of-detail proxies of imported furniture
+class FurnitureLOD:
+    ratios = (0.25, 0.05)  # Decimate ratio of each proxy level after the full mesh
+    thresholds = (150, 40)  # Projected size in pixels below which the next level is used
+    proxies = {}  # model path -> proxy meshes, built once per asset
+
+    @classmethod
+    def meshes_for(cls, furniture):
+        obj = furniture.object
+        if obj is None or obj.type != 'MESH':
+            return []
+        if furniture.model_path not in cls.proxies:
+            cls.proxies[furniture.model_path] = [cls.decimate(obj, ratio) for ratio in cls.ratios]
+
+        # The first material is linked to the object so it stays the same whichever mesh is swapped in,
+        # the other slots keep the asset's own materials like the proxies do
+        if obj.material_slots:
+            obj.material_slots[0].link = 'OBJECT'
+            obj.material_slots[0].material = furniture.material
+        return [obj.data] + cls.proxies[furniture.model_path]
+
+    @staticmethod
+    def decimate(obj, ratio):
+        modifier = obj.modifiers.new(name="LOD_Decimate", type='DECIMATE')
+        modifier.ratio = ratio
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        depsgraph.update()
+        mesh = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph))
+        mesh.name = f"{obj.name}_LOD_{ratio:g}"
+        obj.modifiers.remove(modifier)
+        return mesh
+
+    @classmethod
+    def level_for(cls, projected_size):
+        for level, threshold in enumerate(cls.thresholds):
+            if projected_size >= threshold:
+                return level
+        return len(cls.thresholds)
 
 # Class for creating a room
 class Room:
-    def __init__(self, config):
+    def __init__(self, config, name="Room"):
         self.length = config['room']['length']
         self.width = config['room']['width']
         self.height = config['room']['height']
         self.floor_type = config['floor'].get('type', 'default')
         self.floor_type_file = config['floor'].get('path', 'default')
+        self.collection = self.create_collection(name)
         self.create_floor()
         self.create_walls(config['walls'])
         self.door_material = DoorMaterial("BrownDoorMaterial", (0.396, 0.267, 0.129)).material
         self.add_doors_and_windows(config['doors'], config['windows'])
         self.add_furniture(config['furniture'])
+        view_layer = bpy.context.view_layer
+        view_layer.active_layer_collection = view_layer.layer_collection
+
+    def create_collection(self, name):
+        # Everything the room creates goes into its own collection so cameras can cull it as a whole
+        collection = bpy.data.collections.new(name)
+        bpy.context.scene.collection.children.link(collection)
+        view_layer = bpy.context.view_layer
+        view_layer.active_layer_collection = view_layer.layer_collection.children[collection.name]
+        return collection
+
+    def bounds(self):
+        # Corners of the world space bounding box around every object of the room
+        points = [obj.matrix_world @ Vector(corner) for obj in self.collection.all_objects for corner in obj.bound_box]
+        if not points:
+            return []
+        low = [min(point[axis] for point in points) for axis in range(3)]
+        high = [max(point[axis] for point in points) for axis in range(3)]
+        return [Vector((x, y, z)) for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2])]
 
     def create_floor(self):
         bpy.ops.mesh.primitive_plane_add(size=2, location=(0, 0, 0))
@@ -207,6 +273,7 @@ class Camera:
         self.name = name
         self.location = location
         self.rotation = rotation
+        self.border = None  # Crop region (min x, max x, min y, max y) of the frame, set by PlanFraming
         self.object = self.create_camera()
         self.set_camera_view()
     
@@ -221,9 +288,99 @@ class Camera:
         bpy.context.scene.camera = self.object
         bpy.context.view_layer.objects.active = self.object
 
-    def render(self, filepath):
+    def render(self, filepath, furniture=None, rooms=None):
+        furniture = list(furniture) if furniture is not None else []
+        self.apply_furniture_lod(furniture)
+        excluded = self.cull_rooms(rooms) if rooms is not None else []
+        self.apply_border()
         bpy.context.scene.render.filepath = filepath
-        bpy.ops.render.render(write_still=True)
+        try:
+            bpy.ops.render.render(write_still=True)
+        finally:
+            for layer_collection in excluded:
+                layer_collection.exclude = False
+            # Back to the full meshes so they keep their user and survive saving the file
+            self.restore_furniture_lod(furniture)
+
+    def set_orthographic(self, ortho_scale, sensor_fit):
+        camera_data = self.object.data
+        camera_data.type = 'ORTHO'
+        camera_data.ortho_scale = ortho_scale
+        camera_data.sensor_fit = sensor_fit
+
+    def apply_border(self):
+        render = bpy.context.scene.render
+        render.use_border = self.border is not None
+        render.use_crop_to_border = self.border is not None
+        if self.border is not None:
+            render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y = self.border
+
+    def frustum_planes(self):
+        # Planes (normal, offset) in camera space, a point p is inside when normal.dot(p) + offset >= 0
+        camera_data = self.object.data
+        frame = camera_data.view_frame(scene=bpy.context.scene)
+        planes = [(Vector((0, 0, -1)), -camera_data.clip_start), (Vector((0, 0, 1)), camera_data.clip_end)]
+        if camera_data.type == 'ORTHO':
+            xs = [corner.x for corner in frame]
+            ys = [corner.y for corner in frame]
+            planes += [(Vector((1, 0, 0)), -min(xs)), (Vector((-1, 0, 0)), max(xs)),
+                       (Vector((0, 1, 0)), -min(ys)), (Vector((0, -1, 0)), max(ys))]
+        else:
+            center = sum(frame, Vector()) / len(frame)
+            for corner, next_corner in zip(frame, frame[1:] + frame[:1]):
+                normal = corner.cross(next_corner)
+                planes.append((normal if normal.dot(center) > 0 else -normal, 0))
+        return planes
+
+    def sees(self, corners):
+        # Conservative test, only rejects boxes lying fully outside one frustum plane
+        to_camera = self.object.matrix_world.inverted()
+        points = [to_camera @ corner for corner in corners]
+        for normal, offset in self.frustum_planes():
+            if all(normal.dot(point) + offset < 0 for point in points):
+                return False
+        return True
+
+    def cull_rooms(self, rooms):
+        # Exclude rooms that cannot contribute to this view from the view layer for the render
+        excluded = []
+        bpy.context.view_layer.update()
+        children = bpy.context.view_layer.layer_collection.children
+        for room in rooms:
+            corners = room.bounds()
+            layer_collection = children[room.collection.name]
+            if corners and not self.sees(corners) and not layer_collection.exclude:
+                layer_collection.exclude = True
+                excluded.append(layer_collection)
+        return excluded
+
+    def projected_size(self, obj):
+        # Approximate size in pixels of the object's bounding sphere seen from this camera
+        render = bpy.context.scene.render
+        resolution = max(render.resolution_x, render.resolution_y) * render.resolution_percentage / 100
+        corners = [obj.matrix_world @ Vector(corner) for corner in obj.bound_box]
+        center = sum(corners, Vector()) / len(corners)
+        diameter = max((corner - center).length for corner in corners) * 2
+
+        camera_data = self.object.data
+        if camera_data.type == 'ORTHO':
+            return diameter / camera_data.ortho_scale * resolution
+        depth = -(self.object.matrix_world.inverted() @ center).z
+        if depth <= 0:
+            return 0  # Behind the camera
+        return diameter / depth * camera_data.lens / camera_data.sensor_width * resolution
+
+    def apply_furniture_lod(self, furniture):
+        bpy.context.view_layer.update()
+        for item in furniture:
+            if item.lod_meshes:
+                level = FurnitureLOD.level_for(self.projected_size(item.object))
+                item.object.data = item.lod_meshes[min(level, len(item.lod_meshes) - 1)]
+
+    def restore_furniture_lod(self, furniture):
+        for item in furniture:
+            if item.lod_meshes:
+                item.object.data = item.lod_meshes[0]
 
     
     def set_render_settings(resolution_x=1920, resolution_y=1080, resolution_percentage=100):
@@ -248,11 +405,75 @@ class Camera:
                             space.region_3d.view_perspective = 'ORTHO'
                             space.region_3d.view_rotation = (1.0, 0.0, 0.0, 0.0)        
 
+# Class for placing cameras that tightly frame the plan, so every rendered pixel shows the plan
+class PlanFraming:
+    # Rotation and the view's (right, up, towards camera) world axes for each side the camera looks from
+    views = {
+        'TOP': ((0, 0, 0), (0, 1, 2)),
+        'FRONT': ((math.radians(90), 0, math.radians(180)), (0, 2, 1)),  # From +Y
+        'BACK': ((math.radians(90), 0, 0), (0, 2, 1)),  # From -Y
+        'LEFT': ((math.radians(90), 0, math.radians(-90)), (1, 2, 0)),  # From -X
+        'RIGHT': ((math.radians(90), 0, math.radians(90)), (1, 2, 0)),  # From +X
+    }
+
+    def __init__(self, rooms, margin=0.02, clearance=1.0):
+        self.margin = margin
+        self.clearance = clearance
+        self.low, self.high = self.plan_bounds(rooms)
+
+    def plan_bounds(self, rooms):
+        # Room dimensions around the floor at the origin, grown by every object the rooms created
+        bpy.context.view_layer.update()  # Objects placed since the last update still have a stale matrix_world
+        points = []
+        for room in rooms:
+            points += [Vector((x * room.length / 2, y * room.width / 2, z * room.height))
+                       for x in (-1, 1) for y in (-1, 1) for z in (0, 1)]
+            points += room.bounds()
+        low = Vector([min(point[axis] for point in points) for axis in range(3)])
+        high = Vector([max(point[axis] for point in points) for axis in range(3)])
+        return low, high
+
+    def camera(self, name, view):
+        rotation, (right, up, depth) = self.views[view]
+        center = (self.low + self.high) / 2
+        size = self.high - self.low
+        width = max(size[right] * (1 + 2 * self.margin), 1e-3)
+        height = max(size[up] * (1 + 2 * self.margin), 1e-3)
+
+        # Camera just outside the bounds on the side it looks from
+        location = center.copy()
+        if view in ('FRONT', 'RIGHT', 'TOP'):
+            location[depth] = self.high[depth] + self.clearance
+        else:
+            location[depth] = self.low[depth] - self.clearance
+        camera = Camera(name, tuple(location), rotation)
+        camera.object.data.clip_start = 0.1
+        camera.object.data.clip_end = size[depth] + 2 * self.clearance
+
+        # Ortho scale fits the bounds along the limiting axis, the crop region trims the other one
+        render = bpy.context.scene.render
+        aspect = (render.resolution_x * render.pixel_aspect_x) / (render.resolution_y * render.pixel_aspect_y)
+        if width / height >= aspect:
+            camera.set_orthographic(width, 'HORIZONTAL')
+            frame_width, frame_height = width, width / aspect
+        else:
+            camera.set_orthographic(height, 'VERTICAL')
+            frame_width, frame_height = height * aspect, height
+        border_x = width / frame_width / 2
+        border_y = height / frame_height / 2
+        camera.border = (0.5 - border_x, 0.5 + border_x, 0.5 - border_y, 0.5 + border_y)
+        return camera
 
+# Reject plans with misplaced openings or overlapping furniture before anything gets built
+validate_plan_first = True
 
 with open("D:/Ced_data/json/newren.json", 'r') as f:
     config = json.load(f)
 
+report = validate_plan(config) if validate_plan_first else {'valid': True}
+if not report['valid']:
+    raise ValueError("Plan failed validation: " + "; ".join(issue['message'] for issue in report['issues'][:10]))
+
 # Create a room based on the configuration
 room = Room(config)
 
@@ -264,41 +485,28 @@ for area in bpy.context.screen.areas:
                 space.shading.type = 'MATERIAL'
 
 
-# Setting up camera positions for top and front views
-camera_top_location = (0, 0, 30)  # Adjust height as needed
-camera_top_rotation = (math.radians(360), 0, 0)
-
-camera_front_location = (0, 10, 9)  # Adjust distance and height as needed
-camera_front_rotation = (math.radians(50), 0, math.radians(180))
-
-camera_left_location = (-20, 0, 10)  # Adjust distance and height as needed
-camera_left_rotation = (math.radians(240),math.radians(180), math.radians(90))
-
-camera_right_location = (20, 0, 10)  # Adjust distance and height as needed
-camera_right_rotation = (math.radians(240), math.radians(180), math.radians(-90))
-
-# Create the camera instances
-camera_top = Camera("Camera_Top", camera_top_location, camera_top_rotation)
-camera_front = Camera("Camera_Front", camera_front_location, camera_front_rotation)
-
-camera_left = Camera("Camera_Left", camera_left_location, camera_left_rotation)
-camera_right = Camera("Camera_Right", camera_right_location, camera_right_rotation)
-
-# Set render settings
+# Set render settings, the framing depends on the output aspect ratio
 Camera.set_render_settings()
 
+# Cameras framing the plan bounds tightly from the top and from the sides
+framing = PlanFraming([room])
+camera_top = framing.camera("Camera_Top", 'TOP')
+camera_front = framing.camera("Camera_Front", 'FRONT')
+camera_left = framing.camera("Camera_Left", 'LEFT')
+camera_right = framing.camera("Camera_Right", 'RIGHT')
+
 # Render the top view
 camera_top.set_camera_view()
-camera_top.render("D:/Ced_data/renders/top_view.png")
+camera_top.render("D:/Ced_data/renders/top_view.png", room.furniture.values(), [room])
 
 # Render the front view
 camera_front.set_camera_view()
-camera_front.render("D:/Ced_data/renders/front_view.png")
+camera_front.render("D:/Ced_data/renders/front_view.png", room.furniture.values(), [room])
 
 # Render the left view
 camera_left.set_camera_view()
-camera_left.render("D:/Ced_data/renders/left_view.png")
+camera_left.render("D:/Ced_data/renders/left_view.png", room.furniture.values(), [room])
 
 # Render the right view
 camera_right.set_camera_view()
-camera_right.render("D:/Ced_data/renders/right_view.png")
\ No newline at end of file
+camera_right.render("D:/Ced_data/renders/right_view.png", room.furniture.values(), [room])
\ No newline at end of file
@@ -0,0 +1,353 @@
+import json
+import mmap
+import sys
+import numpy as np
+
+# Compact columnar binary plan format (.bfp)
+#
+# Layout: magic, header length (uint64), JSON header, then 64-byte aligned column blocks.
+# Walls, doors, windows and furniture of every room are stored as typed column arrays
+# (location/scale/rotation as float32 blocks), rooms only keep the offsets of their rows,
+# and all names/paths live in one string pool. Optional vectors (wall color, furniture dimensions)
+# are NaN when missing. The file is memory-mapped and a room's
+# config dict is only rebuilt when it is asked for.
+
+MAGIC = b"BFPLAN01"
+ALIGNMENT = 64
+NO_STRING = 0xFFFFFFFF  # String id used for missing optional strings
+ROOM_KEYS = ('dimensions', 'room', 'floor', 'walls', 'doors', 'windows', 'furniture')
+# Keys of walls, doors/windows and furniture stored in columns, any other key of a row is kept as JSON
+ROW_KEYS = {
+    'wall': ('name', 'location', 'scale', 'rotation', 'color'),
+    'door': ('name', 'wall', 'location', 'scale'),
+    'window': ('name', 'wall', 'location', 'scale'),
+    'furniture': ('name', 'model_path', 'location', 'scale', 'rotation', 'dimensions'),
+}
+
+# Pad a 2D location/scale/rotation from the config to 3D
+def padded(values, fill):
+    return list(values) + [fill] * (3 - len(values))
+
+# Multi-room plans (blender_floorplan.py) hold one dict with 'dimensions' per room key,
+# single room plans (3d.py, june20.py) keep 'room' dimensions and the lists at the top level
+def plan_schema(config):
+    return 'room' if 'room' in config and 'walls' in config else 'rooms'
+
+# Class for writing plan configs into the columnar binary format
+class PlanWriter:
+    def __init__(self, schema='rooms'):
+        self.schema = schema
+        self.strings = {}
+        self.globals = {}
+        self.extras = {}
+        self.row_extras = {kind: {} for kind in ROW_KEYS}  # kind -> {row: keys outside the columns}
+        self.columns = {
+            'room_key': [], 'room_dimensions': [], 'floor_type': [], 'floor_path': [],
+            'wall_offsets': [0], 'door_offsets': [0], 'window_offsets': [0], 'furniture_offsets': [0],
+            'wall_name': [], 'wall_location': [], 'wall_scale': [], 'wall_rotation': [], 'wall_color': [],
+            'door_name': [], 'door_wall': [], 'door_location': [], 'door_scale': [],
+            'window_name': [], 'window_wall': [], 'window_location': [], 'window_scale': [],
+            'furniture_name': [], 'furniture_model_path': [], 'furniture_location': [],
+            'furniture_scale': [], 'furniture_rotation': [], 'furniture_dimensions': [],
+        }
+
+    def string(self, value):
+        if value is None:
+            return NO_STRING
+        if value not in self.strings:
+            self.strings[value] = len(self.strings)
+        return self.strings[value]
+
+    def add_row_extra(self, kind, row):
+        extra = {name: value for name, value in row.items() if name not in ROW_KEYS[kind]}
+        if extra:
+            self.row_extras[kind][str(len(self.columns[kind + '_name']))] = extra
+
+    def add_room(self, key, config):
+        columns = self.columns
+        index = len(columns['room_key'])
+        dimensions_key = 'room' if self.schema == 'room' else 'dimensions'
+        dimensions = config[dimensions_key]
+        floor = config.get('floor', {})
+        columns['room_key'].append(self.string(key))
+        columns['room_dimensions'].append([dimensions['length'], dimensions['width'], dimensions['height']])
+        columns['floor_type'].append(self.string(floor.get('type')))
+        columns['floor_path'].append(self.string(floor.get('path')))
+
+        for wall in config.get('walls', []):
+            self.add_row_extra('wall', wall)
+            columns['wall_name'].append(self.string(wall['name']))
+            columns['wall_location'].append(padded(wall['location'], 0))
+            columns['wall_scale'].append(padded(wall['scale'], 1))
+            columns['wall_rotation'].append(padded(wall['rotation'], 0))
+            columns['wall_color'].append(wall.get('color', [np.nan] * 3))
+        for kind in ('door', 'window'):
+            for opening in config.get(kind + 's', []):
+                self.add_row_extra(kind, opening)
+                columns[kind + '_name'].append(self.string(opening['name']))
+                columns[kind + '_wall'].append(self.string(opening.get('wall')))
+                columns[kind + '_location'].append(padded(opening['location'], 0))
+                columns[kind + '_scale'].append(padded(opening['scale'], 1))
+        for furniture in config.get('furniture', []):
+            self.add_row_extra('furniture', furniture)
+            columns['furniture_name'].append(self.string(furniture['name']))
+            columns['furniture_model_path'].append(self.string(furniture['model_path']))
+            columns['furniture_location'].append(padded(furniture['location'], 0))
+            columns['furniture_scale'].append(padded(furniture['scale'], 1))
+            columns['furniture_rotation'].append(padded(furniture['rotation'], 0))
+            columns['furniture_dimensions'].append(padded(furniture.get('dimensions', [np.nan] * 3), np.nan))
+        for kind, rows in (('wall', 'wall_name'), ('door', 'door_name'), ('window', 'window_name'),
+                           ('furniture', 'furniture_name')):
+            columns[kind + '_offsets'].append(len(columns[rows]))
+
+        # Anything the columns do not cover (ceiling fan, extra floor settings...) is kept as JSON
+        extra = {name: value for name, value in config.items() if name not in ROOM_KEYS}
+        if set(floor) - {'type', 'path'}:
+            extra['floor'] = floor
+        extra_dimensions = {name: value for name, value in dimensions.items()
+                            if name not in ('length', 'width', 'height')}
+        if extra_dimensions:
+            extra[dimensions_key] = extra_dimensions
+        if extra:
+            self.extras[str(index)] = extra
+
+    def arrays(self):
+        arrays = {}
+        for name, values in self.columns.items():
+            if name.endswith('_offsets'):
+                arrays[name] = np.asarray(values, dtype=np.uint64)
+            elif name.endswith(('_dimensions', '_location', '_scale', '_rotation', '_color')):
+                arrays[name] = np.asarray(values, dtype=np.float32).reshape(-1, 3)
+            else:
+                arrays[name] = np.asarray(values, dtype=np.uint32)
+        encoded = [value.encode('utf-8') for value in self.strings]
+        arrays['string_offsets'] = np.cumsum([0] + [len(value) for value in encoded], dtype=np.uint64)
+        arrays['string_data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return arrays
+
+    def write(self, path):
+        arrays = self.arrays()
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header = json.dumps({
+            'version': 1,
+            'schema': self.schema,
+            'columns': layout,
+            'globals': self.globals,
+            'extras': self.extras,
+            'row_extras': self.row_extras,
+        }).encode('utf-8')
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.array(len(header), dtype='<u8').tobytes())
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+
+# Parse the top-level entries of a JSON object one at a time, yielding (key, value) as soon as
+# each value has been read; only the text of the current entry is kept in memory
+def iter_json_rooms(path, chunk_size=1 << 20):
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        position = 0
+        eof = False
+        read_size = chunk_size
+
+        def read_more():
+            nonlocal buffer, position, eof, read_size
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            read_size *= 2  # Grow the reads so a huge room is not re-decoded once per chunk
+
+        def skip_whitespace():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\n\r':
+                    position += 1
+                if position < len(buffer) or eof:
+                    return
+                read_more()
+
+        def expect(characters):
+            nonlocal position
+            skip_whitespace()
+            if position >= len(buffer) or buffer[position] not in characters:
+                raise ValueError(f"Expected one of {characters!r} in {path}")
+            position += 1
+            return buffer[position - 1]
+
+        def decode():
+            nonlocal position, read_size
+            skip_whitespace()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    # A number followed only by number characters may continue in the next chunk,
+                    # e.g. 1.5e3 cut after '1.' decodes as 1 with '.' left over
+                    number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                    if eof or not (number and not buffer[end:].lstrip('0123456789.eE+-')):
+                        position = end
+                        read_size = chunk_size
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                read_more()
+
+        read_more()
+        expect('{')
+        skip_whitespace()
+        if position < len(buffer) and buffer[position] == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            value = decode()
+            yield key, value
+            del value
+            if expect(',}') == '}':
+                return
+
+# Convert a JSON plan of either schema to the binary format
+def convert_json(json_path, plan_path):
+    # Multi-room plans are converted room by room while the JSON is read
+    writer = PlanWriter('rooms')
+    for key, value in iter_json_rooms(json_path):
+        if isinstance(value, dict) and 'dimensions' in value:
+            writer.add_room(key, value)
+        else:
+            writer.globals[key] = value
+    if not writer.columns['room_key'] and plan_schema(writer.globals) == 'room':
+        writer.schema = 'room'
+        writer.add_room('room', writer.globals)
+        writer.globals = {}
+    writer.write(plan_path)
+
+# Class for reading a binary plan; rooms are rebuilt one at a time from the memory-mapped columns
+class PlanReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a binary plan file: {path}")
+        header_length = int(np.frombuffer(self.map, dtype='<u8', count=1, offset=len(MAGIC))[0])
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(self.map[header_start:header_start + header_length]).decode('utf-8'))
+        data_start = -(-(header_start + header_length) // ALIGNMENT) * ALIGNMENT
+
+        self.schema = header['schema']
+        self.globals = header['globals']
+        self.extras = header['extras']
+        self.row_extras = header.get('row_extras', {})
+        self.columns = {}
+        for name, column in header['columns'].items():
+            count = int(np.prod(column['shape']))
+            array = np.frombuffer(self.map, dtype=column['dtype'], count=count, offset=data_start + column['offset'])
+            self.columns[name] = array.reshape(column['shape'])
+        self.index = {self.string(key): index for index, key in enumerate(self.columns['room_key'])}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Column views have to be released before the map can be closed
+        self.columns = {}
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        return self.room(self.index[key])
+
+    def keys(self):
+        return list(self.index)
+
+    def string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+        offsets = self.columns['string_offsets']
+        return bytes(self.columns['string_data'][offsets[string_id]:offsets[string_id + 1]]).decode('utf-8')
+
+    def rows(self, kind, index):
+        offsets = self.columns[kind + '_offsets']
+        return range(int(offsets[index]), int(offsets[index + 1]))
+
+    def with_extra(self, kind, row, values):
+        values.update(self.row_extras.get(kind, {}).get(str(row), {}))
+        return values
+
+    def room(self, index):
+        columns = self.columns
+        length, width, height = columns['room_dimensions'][index].tolist()
+        floor = {}
+        if columns['floor_type'][index] != NO_STRING:
+            floor['type'] = self.string(columns['floor_type'][index])
+        if columns['floor_path'][index] != NO_STRING:
+            floor['path'] = self.string(columns['floor_path'][index])
+
+        walls = []
+        for row in self.rows('wall', index):
+            wall = {
+                'name': self.string(columns['wall_name'][row]),
+                'location': columns['wall_location'][row].tolist(),
+                'scale': columns['wall_scale'][row].tolist(),
+                'rotation': columns['wall_rotation'][row].tolist(),
+            }
+            if not np.isnan(columns['wall_color'][row]).any():
+                wall['color'] = columns['wall_color'][row].tolist()
+            walls.append(self.with_extra('wall', row, wall))
+        openings = {}
+        for kind in ('door', 'window'):
+            openings[kind + 's'] = [self.with_extra(kind, row, {
+                'name': self.string(columns[kind + '_name'][row]),
+                'wall': self.string(columns[kind + '_wall'][row]),
+                'location': columns[kind + '_location'][row].tolist(),
+                'scale': columns[kind + '_scale'][row].tolist(),
+            }) for row in self.rows(kind, index)]
+        furniture = []
+        for row in self.rows('furniture', index):
+            item = {
+                'name': self.string(columns['furniture_name'][row]),
+                'model_path': self.string(columns['furniture_model_path'][row]),
+                'location': columns['furniture_location'][row].tolist(),
+                'scale': columns['furniture_scale'][row].tolist(),
+                'rotation': columns['furniture_rotation'][row].tolist(),
+            }
+            # Plans written before the column existed have no furniture dimensions
+            if 'furniture_dimensions' in columns and not np.isnan(columns['furniture_dimensions'][row]).any():
+                item['dimensions'] = columns['furniture_dimensions'][row].tolist()
+            furniture.append(self.with_extra('furniture', row, item))
+
+        dimensions_key = 'room' if self.schema == 'room' else 'dimensions'
+        extra = dict(self.extras.get(str(index), {}))
+        dimensions = {'length': length, 'width': width, 'height': height, **extra.pop(dimensions_key, {})}
+        config = {dimensions_key: dimensions, 'floor': floor, 'walls': walls, **openings, 'furniture': furniture}
+        config.update(extra)
+        return config
+
+    def rooms(self):
+        # Yields (key, config) one room at a time, nothing is kept between rooms
+        for key, index in self.index.items():
+            yield key, self.room(index)
+
+if __name__ == "__main__":
+    convert_json(sys.argv[1], sys.argv[2])
@@ -0,0 +1,222 @@
+import json
+import sys
+import numpy as np
+
+from plan_io import PlanReader, padded, plan_schema
+
+# Pre-build plan analysis on the raw config, before Blender creates anything
+#
+# Every wall, door/window and piece of furniture becomes an oriented box (center, rotation,
+# half extents) in NumPy arrays; overlaps are found with a sort-based sweep over the bounding
+# boxes followed by a batched separating axis test on the candidate pairs.
+# Walls are planes of size 2 scaled by 'scale', openings cubes of size 2 scaled by 'scale'.
+# Furniture is only checked when it has 'dimensions' (world size); the size of a model is not known
+# before it is imported, so items without them are counted as unsized and skipped.
+
+# Rotation matrices of XYZ euler angles, shape (N, 3, 3)
+def euler_matrices(rotations):
+    rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 3)
+    cos, sin = np.cos(rotations), np.sin(rotations)
+    ones, zeros = np.ones(len(rotations)), np.zeros(len(rotations))
+    rx = np.stack([ones, zeros, zeros, zeros, cos[:, 0], -sin[:, 0], zeros, sin[:, 0], cos[:, 0]], axis=1)
+    ry = np.stack([cos[:, 1], zeros, sin[:, 1], zeros, ones, zeros, -sin[:, 1], zeros, cos[:, 1]], axis=1)
+    rz = np.stack([cos[:, 2], -sin[:, 2], zeros, sin[:, 2], cos[:, 2], zeros, zeros, zeros, ones], axis=1)
+    return rz.reshape(-1, 3, 3) @ ry.reshape(-1, 3, 3) @ rx.reshape(-1, 3, 3)
+
+# Class for holding a batch of oriented boxes and what they belong to
+class Boxes:
+    def __init__(self, kind, owners, centers, matrices, extents):
+        self.kind = kind
+        self.owners = owners  # (room key, element name) of every box
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 3, 3)
+        self.extents = np.asarray(extents, dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.owners)
+
+    def aabb(self):
+        half = np.einsum('nij,nj->ni', np.abs(self.matrices), self.extents)
+        return self.centers - half, self.centers + half
+
+# Index pairs (i, j) of boxes in a and b whose axis aligned bounds overlap
+def candidate_pairs(boxes_a, boxes_b, same, tolerance):
+    if not len(boxes_a) or not len(boxes_b):
+        return np.zeros((0, 2), dtype=np.intp)
+    low_a, high_a = boxes_a.aabb()
+    low_b, high_b = boxes_b.aabb()
+
+    # Sweep along x: with b sorted by its lower x bound, each a only looks at the b boxes
+    # starting within its own x range (minus the widest b box)
+    order = np.argsort(low_b[:, 0], kind='stable')
+    widest = (high_b[:, 0] - low_b[:, 0]).max()
+    first = np.searchsorted(low_b[order, 0], low_a[:, 0] - widest, 'left')
+    last = np.searchsorted(low_b[order, 0], high_a[:, 0] - tolerance, 'left')
+    counts = np.maximum(last - first, 0)
+    rows = np.repeat(np.arange(len(boxes_a)), counts)
+    cols = order[np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+
+    overlap = np.all((low_a[rows] < high_b[cols] - tolerance) & (low_b[cols] < high_a[rows] - tolerance), axis=1)
+    if same:
+        overlap &= rows < cols
+    return np.stack([rows[overlap], cols[overlap]], axis=1)
+
+# Batched separating axis test, True where the boxes of each pair intersect
+def boxes_intersect(boxes_a, boxes_b, pairs, tolerance):
+    if not len(pairs):
+        return np.zeros(0, dtype=bool)
+    axes_a = np.swapaxes(boxes_a.matrices[pairs[:, 0]], 1, 2)  # Rows are the box axes
+    axes_b = np.swapaxes(boxes_b.matrices[pairs[:, 1]], 1, 2)
+    extents_a = boxes_a.extents[pairs[:, 0]]
+    extents_b = boxes_b.extents[pairs[:, 1]]
+    offset = boxes_b.centers[pairs[:, 1]] - boxes_a.centers[pairs[:, 0]]
+
+    crosses = np.cross(axes_a[:, :, None, :], axes_b[:, None, :, :]).reshape(-1, 9, 3)
+    axes = np.concatenate([axes_a, axes_b, crosses], axis=1)
+    lengths = np.linalg.norm(axes, axis=2)
+    valid = lengths > 1e-9  # Cross products of parallel edges carry no axis
+    axes = axes / np.where(valid, lengths, 1)[..., None]
+
+    radius_a = np.einsum('pk,pak->pa', extents_a, np.abs(np.einsum('pkd,pad->pak', axes_a, axes)))
+    radius_b = np.einsum('pk,pak->pa', extents_b, np.abs(np.einsum('pkd,pad->pak', axes_b, axes)))
+    distance = np.abs(np.einsum('pd,pad->pa', offset, axes))
+    separated = valid & (distance >= radius_a + radius_b - tolerance)
+    return ~separated.any(axis=1)
+
+# Class for collecting the boxes of a plan and running the checks on them
+class PlanValidator:
+    def __init__(self, tolerance=1e-3, check_named_walls=True):
+        self.tolerance = tolerance
+        self.check_named_walls = check_named_walls
+        self.walls, self.openings, self.furniture = [], [], []
+        self.unsized = 0
+
+    # Only the boxes of a room are kept, so rooms can be added as they are streamed in
+    def add(self, key, config):
+        for wall in config.get('walls', []):
+            scale = padded(wall['scale'], 1)
+            self.walls.append(((key, wall['name']), padded(wall['location'], 0), padded(wall['rotation'], 0),
+                               (scale[0], scale[1], 0)))
+        for kind in ('doors', 'windows'):
+            for opening in config.get(kind, []):
+                self.openings.append(((key, opening['name']), padded(opening['location'], 0), (0, 0, 0),
+                                      padded(opening['scale'], 1), opening.get('wall')))
+        for item in config.get('furniture', []):
+            if 'dimensions' not in item:
+                self.unsized += 1
+                continue
+            extents = [value / 2 for value in padded(item['dimensions'], 0)]
+            self.furniture.append(((key, item['name']), padded(item['location'], 0), padded(item['rotation'], 0),
+                                   extents))
+
+    def collect(self, rooms):
+        for key, config in rooms:
+            self.add(key, config)
+
+        def boxes(kind, rows):
+            return Boxes(kind, [row[0] for row in rows], [row[1] for row in rows],
+                         euler_matrices([row[2] for row in rows]), [row[3] for row in rows])
+
+        return boxes('wall', self.walls), boxes('opening', self.openings), boxes('furniture', self.furniture), \
+            [row[4] for row in self.openings]
+
+    def check_openings_on_walls(self, walls, openings, wall_names):
+        issues = []
+        wall_ids = {owner: index for index, owner in enumerate(walls.owners)}
+        opening_rows, wall_rows = [], []
+        for index, ((key, name), wall_name) in enumerate(zip(openings.owners, wall_names)):
+            if (key, wall_name) in wall_ids:
+                opening_rows.append(index)
+                wall_rows.append(wall_ids[(key, wall_name)])
+            else:
+                issues.append({'check': 'missing_wall', 'room': key, 'element': name, 'other': wall_name,
+                               'message': f"{name} refers to wall {wall_name!r} which {key} does not have"})
+        if not opening_rows:
+            return issues
+
+        # Opening center and extents in the named wall's local frame
+        opening_rows, wall_rows = np.array(opening_rows), np.array(wall_rows)
+        to_wall = np.swapaxes(walls.matrices[wall_rows], 1, 2)
+        local = np.einsum('nij,nj->ni', to_wall, openings.centers[opening_rows] - walls.centers[wall_rows])
+        reach = np.einsum('nij,nj->ni', np.abs(to_wall @ openings.matrices[opening_rows]), openings.extents[opening_rows])
+        extents = walls.extents[wall_rows]
+        inside = np.all(np.abs(local[:, :2]) + reach[:, :2] <= extents[:, :2] + self.tolerance, axis=1)
+        crosses = np.abs(local[:, 2]) <= reach[:, 2] + self.tolerance
+        for row in np.nonzero(~(inside & crosses))[0]:
+            key, name = openings.owners[opening_rows[row]]
+            wall_name = walls.owners[wall_rows[row]][1]
+            reason = "does not cross" if inside[row] else "extends outside"
+            issues.append({'check': 'opening_outside_wall', 'room': key, 'element': name, 'other': wall_name,
+                           'message': f"{name} {reason} its wall {wall_name}"})
+        return issues
+
+    # True for the pairs that are the same opening listed by both rooms of a shared wall: equal
+    # boxes, different rooms and named walls lying in the same plane
+    def shared_openings(self, walls, openings, wall_names, hits):
+        if not len(walls):
+            return np.zeros(len(hits), dtype=bool)
+        wall_ids = {owner: index for index, owner in enumerate(walls.owners)}
+        opening_walls = np.array([wall_ids.get((key, wall_name), -1)
+                                  for (key, _), wall_name in zip(openings.owners, wall_names)], dtype=np.intp)
+        first, second = hits[:, 0], hits[:, 1]
+        same_box = (np.all(np.abs(openings.centers[first] - openings.centers[second]) <= self.tolerance, axis=1)
+                    & np.all(np.abs(openings.extents[first] - openings.extents[second]) <= self.tolerance, axis=1))
+        other_room = np.array([openings.owners[i][0] != openings.owners[j][0] for i, j in hits], dtype=bool)
+        wall_a, wall_b = opening_walls[first], opening_walls[second]
+        named = (wall_a >= 0) & (wall_b >= 0)
+        normal_a, normal_b = walls.matrices[wall_a, :, 2], walls.matrices[wall_b, :, 2]
+        coplanar = ((np.abs(np.einsum('nd,nd->n', normal_a, normal_b)) >= 1 - self.tolerance)
+                    & (np.abs(np.einsum('nd,nd->n', normal_a, walls.centers[wall_b] - walls.centers[wall_a]))
+                       <= self.tolerance))
+        return same_box & other_room & named & coplanar
+
+    def check_overlaps(self, check, boxes_a, boxes_b, same=False, ignore=None):
+        pairs = candidate_pairs(boxes_a, boxes_b, same, self.tolerance)
+        hits = pairs[boxes_intersect(boxes_a, boxes_b, pairs, self.tolerance)]
+        if ignore is not None:
+            hits = hits[~ignore(hits)]
+        issues = []
+        for i, j in hits:
+            (key, name), (other_key, other_name) = boxes_a.owners[i], boxes_b.owners[j]
+            issues.append({'check': check, 'room': key, 'element': name,
+                           'other': other_name if other_key == key else f"{other_key}/{other_name}",
+                           'message': f"{boxes_a.kind} {name} overlaps {boxes_b.kind} {other_name}"})
+        return issues
+
+    # Checks the given rooms together with the ones added before
+    def validate(self, rooms=()):
+        walls, openings, furniture, wall_names = self.collect(rooms)
+        issues = []
+        if self.check_named_walls:
+            issues += self.check_openings_on_walls(walls, openings, wall_names)
+        issues += self.check_overlaps('opening_overlap', openings, openings, same=True,
+                                      ignore=lambda hits: self.shared_openings(walls, openings, wall_names, hits))
+        issues += self.check_overlaps('furniture_wall_overlap', furniture, walls)
+        issues += self.check_overlaps('furniture_opening_overlap', furniture, openings)
+        issues += self.check_overlaps('furniture_overlap', furniture, furniture, same=True)
+        return {
+            'valid': not issues,
+            'counts': {'walls': len(walls), 'openings': len(openings), 'furniture': len(furniture),
+                       'unsized_furniture': self.unsized},
+            'issues': issues,
+        }
+
+# Validate a whole plan of either schema, loaded JSON or an open binary plan
+def validate_plan(config, **options):
+    if isinstance(config, PlanReader):
+        rooms = config.rooms()
+    elif plan_schema(config) == 'room':
+        rooms = [('room', config)]
+    else:
+        rooms = [(key, value) for key, value in config.items() if isinstance(value, dict) and 'dimensions' in value]
+    return PlanValidator(**options).validate(rooms)
+
+if __name__ == "__main__":
+    if sys.argv[1].endswith('.bfp'):
+        with PlanReader(sys.argv[1]) as plan:
+            report = validate_plan(plan)
+    else:
+        with open(sys.argv[1], 'r') as f:
+            report = validate_plan(json.load(f))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['valid'] else 1)